@@ -1,14 +1,70 @@
 import pyvisa
 import numpy as np
 
+from pyvisa.resources import TCPIPSocket
+
 from typing import Union
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+_rm = None
+
+# The minimum number of samples in a trace for which the conversion is done 
+# using numba. For shorter traces, numpy is fast enough and the one-time 
+# compilation of the numba kernel would not pay off.
+_NUMBA_MIN_SAMPLES = 1000000
+
+# Data types admissible for the y values of traces.
+_Y_DTYPES = (np.dtype(np.float32), np.dtype(np.float64))
+
+# SCPI source names of the input channels.
+_CHANNEL_NAMES = {1: "CHAN1", 2: "CHAN2", 3: "CHAN3", 4: "CHAN4"}
+
+
+def _get_resource_manager() -> pyvisa.ResourceManager:
+    """Returns the VISA resource manager shared by all instances, which is 
+    created on first use. Creating a resource manager loads the VISA library 
+    and can take a long time.
+    """
+    global _rm
+    if _rm is None:
+        _rm = pyvisa.ResourceManager()
+    return _rm
+
+
+if numba is not None:
+    @numba.njit(parallel=True, cache=True)
+    def _scale_samples(raw, ref, inc, origin, out):
+        """Computes out = (raw - ref) * inc + origin in a single parallel pass 
+        over the data, without intermediate arrays. The calculation is done 
+        in double precision and the result is rounded to the type of out once.
+        """
+        for i in numba.prange(raw.shape[0]):
+            out[i] = (raw[i] - ref) * inc + origin
+
+
+def _source_name(channel: Union[int, str]) -> str:
+    """Converts a channel number to the corresponding SCPI source name. 
+    Channel names given as strings are returned unchanged.
+    """
+    if not isinstance(channel, str):
+        try:
+            channel = _CHANNEL_NAMES[channel]
+        except KeyError:
+            raise ValueError(f"Invalid channel number: {channel}") from None
+    return channel
+
 
 class DSOX2000:
     """A class for communication with DSO-X 2000-series scopes.
 
     Attributes:
         comm: A visa communication resource.
+        cache_preamble: Whether waveform preambles are cached between traces.
 
     Args:
         address: 
@@ -18,55 +74,253 @@ class DSOX2000:
             It was observed that even scopes of the same model and the same 
             firmware version can expect different terminations, but the current 
             default seems to work for all of them. 
+        chunk_size:
+            Size of the chunks (in bytes) in which data is read from the 
+            instrument. A large value lets long binary traces be transferred 
+            in few read calls.
+        timeout:
+            Communication timeout in milliseconds. Has to be long enough for 
+            the transfer of full-length traces.
+        cache_preamble:
+            If True, the waveform preamble (the scaling factors of the trace)
+            is queried once per channel and reused by subsequent get_trace 
+            calls, until the timebase or the acquisition state is changed 
+            using the methods of this class. A cached preamble is also 
+            re-queried if its number of points does not match the data. Only 
+            enable this if the scope settings are not changed by other means 
+            (e.g. from the front panel) in the meantime.
         rsc_kwargs: 
             Other keyword arguments passed to ResourceManager.open_resource()
             to configure the created resource. See the documentation of pyvisa
             module for their details.
     """
     comm = None
+    cache_preamble = False
 
     def __init__(self, address: str = "TCPIP0::dx2024a.qopt.nbi.dk::INSTR",
                  read_termination: str = "\n",
                  write_termination: str = "\n",
+                 chunk_size: int = 4 * 1024 * 1024,
+                 timeout: float = 10000,
+                 cache_preamble: bool = False,
                  **rsc_kwargs):
 
         rsc_kwargs['read_termination'] = read_termination
         rsc_kwargs['write_termination'] = write_termination
+        rsc_kwargs['chunk_size'] = chunk_size
+        rsc_kwargs['timeout'] = timeout
+
+        self.cache_preamble = cache_preamble
+        self._preamble_cache = {}
+        self._time_axis = None
 
         # Connects to the device.
-        rm = pyvisa.ResourceManager()
+        rm = _get_resource_manager()
         self.comm = rm.open_resource(address, **rsc_kwargs)
 
+        # Raw socket connections send short commands immediately rather
+        # than letting the TCP stack coalesce them (Nagle's algorithm),
+        # which otherwise delays every query round trip.
+        if isinstance(self.comm, TCPIPSocket):
+            try:
+                self.comm.set_visa_attribute(
+                    pyvisa.constants.VI_ATTR_TCPIP_NODELAY,
+                    pyvisa.constants.VI_TRUE)
+            except pyvisa.errors.VisaIOError:
+                # The attribute is not supported by every VISA backend.
+                pass
+
         # Asks for an identifier and validates it.
         id = self.comm.query("*IDN?")
         if not "dso-x 20" in id.lower():
             raise IOError(f"The device returns an wrong IDN string: {id}")
 
         # Sets the waveform output format to: signed binary,
-        # two bytes per data point, most significan bit byte first,
-        # always request the maximum number of points in the trace.
+        # two bytes per data point, least significant byte first (which is 
+        # the native byte order of common computers, so that the data does 
+        # not need to be swapped), always request the maximum number of points 
+        # in the trace.
         self.comm.write(":WAVeform:FORMat WORD;"
                         ":WAVeform:UNSigned OFF;"
-                        ":WAVeform:BYTeorder MSBFirst;"
+                        ":WAVeform:BYTeorder LSBFirst;"
                         ":WAVeform:POINts:MODE MAXimum")
 
-    def get_trace(self, channel: Union[int, str] = 1) -> dict:
+    def get_trace(self, channel: Union[int, str] = 1,
+                  dtype: type = np.float32,
+                  out: Union[np.ndarray, None] = None) -> dict:
         """Reads a single trace from the specified scope channel. Requests 
-        the maximum number of samples.
+        the maximum number of samples. The acquisition state is not changed,
+        i.e. the trace is read as it is (use aquire_single, acquire_continuous 
+        and stop_acquisition to control the acquisition).
 
         Args:
             channel: 
                 Channel name or number. Can be an integer for input channels or 
                 a string admissible by waveform:source, e.g. one of the
                 ('chan<n>', 'func', 'math', 'wmem').  
+            dtype:
+                The data type of the returned y values, np.float32 or 
+                np.float64. Single precision 
+                is sufficient to represent the 16-bit samples transferred 
+                from the scope, use np.float64 if double is needed downstream. 
+                The x values are always double precision. Note that for long 
+                traces, if numba is installed, the scaling is calculated 
+                in double precision and rounded to dtype once, while otherwise 
+                it is calculated in dtype, so single-precision results can 
+                differ in the last digit between the two cases.
+            out:
+                An optional preallocated array, into which the y values are 
+                written and which is returned under the key 'y'. It has to be 
+                a one-dimensional np.float32 or np.float64 array with the 
+                length equal to the number of samples in the trace. Its data 
+                type takes precedence over dtype. Reusing the same array saves 
+                an allocation per trace in acquisition loops.
 
         Returns:
             A dictionary with the x and y data (under the keys 'x' and 'y'), 
-            and optionally metadata.
+            and optionally metadata. The x array can be shared with other 
+            traces acquired with the same timebase and is read-only.
+        """
+
+        channel = _source_name(channel)
+        pre, y_raw = self._read_trace_data(channel)
+
+        return self._convert_trace(channel, pre, y_raw, dtype, out)
+
+    def get_traces(self, channels: tuple = (1, 2),
+                   dtype: type = np.float32) -> dict:
+        """Acquires a single shot simultaneously on several channels and 
+        reads the traces. Unlike separate single acquisitions for each 
+        channel, all the traces come from one trigger event. The acquisition
+        is stopped afterwards.
+
+        Args:
+            channels: 
+                A sequence of channel names or numbers, as accepted by 
+                get_trace. The sources have to be admissible by :DIGitize, 
+                i.e. input channels or the func/math channel.
+            dtype:
+                The data type of the returned y values, see get_trace.
+
+        Returns:
+            A dictionary with the traces as returned by get_trace, 
+            under the keys from channels.
+        """
+        sources = [_source_name(ch) for ch in channels]
+
+        # Stopping the acquisition switches the waveform record, which changes
+        # the preamble.
+        self._preamble_cache.clear()
+
+        # The scope does not process further commands until the acquisition
+        # is complete, so the queries below wait for the data to be ready.
+        self.comm.write(":DIGitize " + ",".join(sources))
+
+        return {ch: self.get_trace(ch, dtype) for ch in channels}
+
+    def get_traces_streaming(self, channel: Union[int, str] = 1, n: int = 1,
+                             dtype: type = np.float32) -> list:
+        """Acquires and reads a series of single-shot traces from one channel.
+        The acquisition of each next trace is started as soon as the data of 
+        the previous one is received, so that the scope acquires while the 
+        previous trace is being converted on the computer. The acquisition 
+        is stopped afterwards.
+
+        Args:
+            channel: 
+                Channel name or number, as accepted by get_trace. The source 
+                has to be admissible by :DIGitize.
+            n:
+                The number of traces to acquire.
+            dtype:
+                The data type of the returned y values, see get_trace.
+
+        Returns:
+            A list of n traces as returned by get_trace.
+        """
+        channel = _source_name(channel)
+
+        # Stopping the acquisition switches the waveform record, which changes
+        # the preamble.
+        self._preamble_cache.clear()
+
+        trs = []
+        if n > 0:
+            self.comm.write(f":DIGitize {channel}")
+
+        for i in range(n):
+            pre, y_raw = self._read_trace_data(channel)
+
+            if i < n - 1:
+                self.comm.write(f":DIGitize {channel}")
+
+            trs.append(self._convert_trace(channel, pre, y_raw, dtype))
+
+        return trs
+
+    def _read_trace_data(self, channel: str) -> tuple:
+        """Reads the waveform preamble and the raw data from the specified 
+        source. Returns the preamble string and the data as an integer array.
         """
 
-        if type(channel) is not str:
-            channel = "CHAN%i" % channel
+        # Configures the waveform source and reads the waveform preamble in
+        # a single compound command. The preamble contains all the scaling
+        # factors and the acquisition type, so the instrument only has
+        # to parse one query.
+        if self.cache_preamble and channel in self._preamble_cache:
+            self.comm.write(f":WAVeform:SOURce {channel}")
+            pre = self._preamble_cache[channel]
+        else:
+            pre = self.comm.query(f":WAVeform:SOURce {channel};"
+                                  ":WAVeform:PREamble?")
+            if self.cache_preamble:
+                self._preamble_cache[channel] = pre
+
+        # Reads the y values. The data type is as configured in init:
+        # short (two-byte integer), with the least significant byte first.
+        y_raw = self._query_binary_block(":WAVeform:DATA?", dtype="<i2")
+
+        # The number of points in the preamble is checked against the data 
+        # as a safeguard against a cached preamble being out of date.
+        if self.cache_preamble and int(pre.split(sep=',')[2]) != len(y_raw):
+            pre = self.comm.query(":WAVeform:PREamble?")
+            self._preamble_cache[channel] = pre
+
+        return pre, y_raw
+
+    def _query_binary_block(self, query: str, dtype: str) -> np.ndarray:
+        """Sends a query and reads the response in the IEEE 488.2 definite
+        length block format, #<N><length><data>, where N is the number of 
+        digits in the length. The data is read with a single read_bytes call 
+        of known size and is returned as an array of the given type without
+        copying.
+        """
+        self.comm.write(query)
+
+        # Only definite length blocks are supported, for which the number of 
+        # digits is a non-zero decimal digit.
+        header = self.comm.read_bytes(2)
+        n_digits = header[1:2]
+        if header[:1] != b"#" or not n_digits.isdigit() or n_digits == b"0":
+            raise IOError("The device returns an invalid block header: "
+                          f"{header}")
+
+        n = int(self.comm.read_bytes(int(n_digits)))
+        data = self.comm.read_bytes(n)
+
+        # Reads the termination that follows the block.
+        if self.comm.read_termination:
+            self.comm.read_bytes(len(self.comm.read_termination))
+
+        return np.frombuffer(data, dtype=dtype)
+
+    def _convert_trace(self, channel: str, pre: str, y_raw: np.ndarray,
+                       dtype: type = np.float32,
+                       out: Union[np.ndarray, None] = None) -> dict:
+        """Converts raw data read from the scope into a trace dictionary 
+        using the scaling factors from the waveform preamble. See get_trace
+        for the description of the arguments and the output.
+        """
 
         d = {"x": None, "y": None}  # Output dictionary
 
@@ -74,39 +328,77 @@ class DSOX2000:
         # and the units. Otherwise (e.g. if is the data is FFT from the func
         # channel), the x and y values are still read out, but currently no
         # information about the axes labels is added.
-        if channel.lower().startswith('chan'):
+        if channel[:4].lower() == 'chan':
             d.update({"xlabel": "Time (s)", "ylabel": "Voltage (V)"})
 
-        # Configures the waveform source.
-        self.comm.write(f":WAVeform:SOURce {channel}")
+        (_, acq_type, _, _,
+         x_inc, x_0, x_ref, y_inc, y_0, y_ref) = pre.split(sep=',')
 
-        # Reads the y values. The data type is as configured in init:
-        # short (two-byte integer), with the most significan byte first.
-        y_raw = self.comm.query_binary_values(":WAVeform:DATA?",
-                                              datatype="h",
-                                              is_big_endian=True,
-                                              container=np.ndarray)
-
-        resp = self.comm.query(":WAVeform:XINCrement?;"
-                               ":WAVeform:XORigin?;"
-                               ":WAVeform:YINCrement?;"
-                               ":WAVeform:YORigin?;"
-                               ":ACQuire:TYPE?")
-        rln = resp.split(sep=';')
-
-        x_inc, x_0, y_inc, y_0, acq_type = *[float(s) for s in rln[:4]], rln[4]
-
-        if acq_type.lower().startswith('peak'):
-            # In the peak detection mode, there are two y points for one time 
-            # stamp, for the min and max values.
-            x_raw_ = np.arange(len(y_raw) // 2)
-            x_raw = np.reshape(np.vstack([x_raw_, x_raw_]).T, (len(y_raw),))
+        x_inc, x_0, x_ref = float(x_inc), float(x_0), int(x_ref)
+        y_inc, y_0, y_ref = float(y_inc), float(y_0), int(y_ref)
+
+        # Calculates the x axis and scales the y data as defined in 
+        # the programming manual, 
+        # time = (index - x_ref) * x_inc + x_0, 
+        # voltage = (value - y_ref) * y_inc + y_0. 
+        # The operations are done in place, which avoids allocating 
+        # intermediate arrays for long traces.
+
+        # The time axis only depends on the timebase, so it is shared 
+        # between consecutive traces with the same settings, e.g. between 
+        # all the channels read by get_traces. The shared array is read-only.
+        x_key = (int(acq_type), len(y_raw), x_inc, x_0, x_ref)
+        if self._time_axis is not None and self._time_axis[0] == x_key:
+            x = self._time_axis[1]
+        else:
+            # The acquisition type is 0 for NORMal, 1 for PEAK, 2 for AVERage
+            # and 3 for HRESolution.
+            if int(acq_type) == 1:
+                # In the peak detection mode, there are two y points for one 
+                # time stamp, for the min and max values.
+                x = np.repeat(np.arange(len(y_raw) // 2, dtype=np.float64), 2)
+            else:
+                x = np.arange(len(y_raw), dtype=np.float64)
+
+            # The reference is usually zero, then its subtraction is skipped.
+            if x_ref:
+                x -= x_ref
+            x *= x_inc
+            x += x_0
+
+            x.setflags(write=False)
+            self._time_axis = (x_key, x)
+
+        if out is None:
+            if np.dtype(dtype) not in _Y_DTYPES:
+                raise ValueError("The data type has to be np.float32 or "
+                                 f"np.float64, got {np.dtype(dtype)}.")
+            y = np.empty(len(y_raw), dtype=dtype)
+        elif out.ndim != 1 or out.dtype not in _Y_DTYPES:
+            raise ValueError("The output array has to be one-dimensional "
+                             "and of type np.float32 or np.float64, got "
+                             f"a {out.ndim}-D array of {out.dtype}.")
+        elif len(out) != len(y_raw):
+            raise ValueError(f"The output array has length {len(out)}, "
+                             f"while the trace has {len(y_raw)} samples.")
         else:
-            x_raw = np.arange(len(y_raw))
+            y = out
 
-        # Calculates the x axis and scales the y data.
-        d["x"] = x_0 + x_inc * x_raw
-        d["y"] = y_0 + y_inc * y_raw
+        if numba is not None and len(y_raw) >= _NUMBA_MIN_SAMPLES:
+            # Converts and scales long traces in one pass using numba.
+            _scale_samples(y_raw, y_ref, y_inc, y_0, y)
+        else:
+            # Skips the operations that do not change the data.
+            y[...] = y_raw
+            if y_ref:
+                y -= y_ref
+            if y_inc != 1:
+                y *= y_inc
+            if y_0:
+                y += y_0
+
+        d["x"] = x
+        d["y"] = y
 
         return d
 
@@ -114,26 +406,62 @@ class DSOX2000:
         """Initiates the aquisition of a single trace (same as pressing 
         the SINGLE button).
         """
+        self._preamble_cache.clear()
         self.comm.write(":SINGle")
 
     def acquire_continuous(self):
         """Initiates continuous data acquitions (same as pressing 
         the RUN button).
         """
+        self._preamble_cache.clear()
         self.comm.write(":RUN")
 
     def stop_acquisition(self):
         """Stops data aquisition (same as pressing the STOP button)."""
+        self._preamble_cache.clear()
         self.comm.write(":STOP")
 
     def set_time_per_division(self, t: Union[float, str]):
         """Set horizontal time scale per division in seconds."""
+        self._preamble_cache.clear()
         self.comm.write(f":TIMebase:SCALe {t}")
 
     def set_total_time(self, t: Union[float, str]):
         """Sets horizontal time in seconds (total time)."""
+        self._preamble_cache.clear()
         self.comm.write(f":TIMebase:RANGe {t}")
 
+    def configure(self, time_per_division: Union[float, str, None] = None,
+                  total_time: Union[float, str, None] = None,
+                  channel_scales: Union[dict, None] = None):
+        """Applies several settings at once, sending them to the scope as 
+        a single compound command. The settings that are None are not changed.
+
+        Args:
+            time_per_division:
+                Horizontal time scale per division in seconds.
+            total_time:
+                Horizontal time in seconds (total time).
+            channel_scales:
+                A dictionary of vertical scales in volts per division 
+                under the keys that are input channel names or numbers.
+        """
+        cmds = []
+
+        if time_per_division is not None:
+            cmds.append(f":TIMebase:SCALe {time_per_division}")
+
+        if total_time is not None:
+            cmds.append(f":TIMebase:RANGe {total_time}")
+
+        if channel_scales:
+            for ch, v in channel_scales.items():
+                cmds.append(f":{_source_name(ch)}:SCALe {v}")
+
+        if cmds:
+            self._preamble_cache.clear()
+            self.comm.write(";".join(cmds))
+
     def measure_average_voltage(self, channel: Union[int, str] = 1,
                                 interval="display") -> float:
         """Reads the average voltage of a given channel in volts.
@@ -143,8 +471,13 @@ class DSOX2000:
         number of periods of the signal. If at least three edges are not
         present, the oscilloscope averages all data points.
         """
-        if type(channel) is not str:
-            channel = "CHAN%i" % channel
+        channel = _source_name(channel)
 
         v_avg = self.comm.query(f":MEASure:VAVerage? {interval},{channel}")
         return float(v_avg)
+
+    def close(self):
+        """Closes the connection to the instrument. The VISA resource manager 
+        is shared with other instances and stays open.
+        """
+        self.comm.close()
@@ -34,5 +34,6 @@ setup(
     ],
     keywords="sample, setuptools, development",
     packages=find_packages(where="."),
+    extras_require={"numba": ["numba"]},
     python_requires=">=3.6, <4"
 )
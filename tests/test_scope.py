@@ -1,4 +1,5 @@
 import unittest
+import numpy as np
 import matplotlib.pyplot as plt
 
 from time import sleep
@@ -34,10 +35,121 @@ class InstrTest(unittest.TestCase):
         self.assertTrue((tr["y"] == tr2["y"]).all())
         self.assertEqual(tr["x"].shape, tr["y"].shape)
 
+        # The data has to be returned as numpy arrays, not lists.
+        self.assertIsInstance(tr["x"], np.ndarray)
+        self.assertIsInstance(tr["y"], np.ndarray)
+        self.assertEqual(tr["x"].dtype, np.float64)
+        self.assertEqual(tr["y"].dtype, np.float32)
+
         plt.plot(tr["x"], tr["y"])
         plt.xlabel(tr['xlabel'])
         plt.ylabel(tr['ylabel'])
 
+    def test_get_trace_out(self):
+        s = DSOX2000(self.instr_address)
+
+        n = 1  # Channel number
+
+        s.aquire_single()
+        sleep(1)
+
+        tr = s.get_trace(n)
+        out = np.empty_like(tr["y"])
+
+        # The same output array is reused for two reads.
+        tr1 = s.get_trace(n, out=out)
+        self.assertIs(tr1["y"], out)
+        self.assertTrue((tr1["y"] == tr["y"]).all())
+
+        tr2 = s.get_trace(n, out=out)
+        s.acquire_continuous()
+
+        self.assertIs(tr2["y"], out)
+        self.assertTrue((tr2["y"] == tr["y"]).all())
+
+        with self.assertRaises(ValueError):
+            s.get_trace(n, out=np.empty(len(tr["y"]), dtype=np.int16))
+
+        with self.assertRaises(ValueError):
+            s.get_trace(n, out=np.empty(len(tr["y"]), dtype=np.float16))
+
+    def test_get_traces(self):
+        s = DSOX2000(self.instr_address)
+
+        channels = (1, "chan2")
+
+        trs = s.get_traces(channels)
+        s.acquire_continuous()
+
+        self.assertEqual(set(trs.keys()), set(channels))
+
+        for tr in trs.values():
+            self.assertEqual(tr["x"].shape, tr["y"].shape)
+
+        # The traces are acquired simultaneously, so the time axes coincide.
+        self.assertTrue((trs[1]["x"] == trs["chan2"]["x"]).all())
+
+    def test_get_traces_streaming(self):
+        s = DSOX2000(self.instr_address)
+
+        n = 3  # Number of traces
+
+        trs = s.get_traces_streaming(1, n)
+        s.acquire_continuous()
+
+        self.assertEqual(len(trs), n)
+
+        for tr in trs:
+            self.assertEqual(tr["x"].shape, tr["y"].shape)
+
+    def test_cache_preamble(self):
+        s = DSOX2000(self.instr_address, cache_preamble=True)
+        s_ref = DSOX2000(self.instr_address)
+
+        n = 1  # Channel number
+
+        # While running and after stopping, the scope returns different 
+        # waveform records, and the cached preamble has to follow the change.
+        s.acquire_continuous()
+        sleep(1)
+        tr_run = s.get_trace(n)
+        self.assertEqual(tr_run["x"].shape, tr_run["y"].shape)
+
+        s.stop_acquisition()
+        tr = s.get_trace(n)
+        tr_ref = s_ref.get_trace(n)
+        s.acquire_continuous()
+
+        self.assertEqual(tr["x"].shape, tr["y"].shape)
+        self.assertTrue((tr["x"] == tr_ref["x"]).all())
+        self.assertTrue((tr["y"] == tr_ref["y"]).all())
+
+    def test_configure(self):
+        s = DSOX2000(self.instr_address)
+
+        t_div = 1e-4  # Time per division (s)
+        v_div = 0.5  # Channel 1 scale (V/div)
+
+        # Restores the original settings after the test.
+        t_div_0 = float(s.comm.query(":TIMebase:SCALe?"))
+        v_div_0 = float(s.comm.query(":CHAN1:SCALe?"))
+        self.addCleanup(s.configure, time_per_division=t_div_0,
+                        channel_scales={1: v_div_0})
+
+        s.configure(time_per_division=t_div, channel_scales={1: v_div})
+
+        self.assertAlmostEqual(float(s.comm.query(":TIMebase:SCALe?")), t_div)
+        self.assertAlmostEqual(float(s.comm.query(":CHAN1:SCALe?")), v_div)
+
+        # While running, the trace spans the ten horizontal divisions 
+        # of the screen.
+        s.acquire_continuous()
+        sleep(1)
+        tr = s.get_trace(1)
+
+        span = tr["x"][-1] - tr["x"][0]
+        self.assertAlmostEqual(span / (10 * t_div), 1, delta=0.05)
+
     def test_measure_average_voltage(self):
         s = DSOX2000(self.instr_address)
 